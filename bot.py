@@ -1,24 +1,56 @@
 import asyncio
+import contextlib
+import glob
+import hashlib
 import logging
 import json
 import os
+import pickle
 import re
-import random
+import sqlite3
 import subprocess
 import sys
+import time
+from collections import OrderedDict
 from typing import Optional
+import aiofiles
 import anthropic
+import httpx
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
+from telegram.ext import AIORateLimiter, Application, CommandHandler, CallbackQueryHandler, ContextTypes
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps(obj, indent: bool = True) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj, indent: bool = True) -> bytes:
+        return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode()
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def ensure_playwright_browser():
-    """Install Playwright Chromium browser if not already present."""
+def _chromium_installed() -> bool:
+    """Return True if Playwright can launch headless Chromium."""
+    browsers = os.getenv("PLAYWRIGHT_BROWSERS_PATH")
+    if browsers != "0" and (browsers or sys.platform.startswith("linux")):
+        # Known cache root: look for a finished download instead of booting Chromium
+        browsers = browsers or os.path.expanduser("~/.cache/ms-playwright")
+        return bool(glob.glob(os.path.join(browsers, "chromium_headless_shell-*", "INSTALLATION_COMPLETE")))
     try:
         from playwright.sync_api import sync_playwright
         with sync_playwright() as p:
@@ -26,15 +58,22 @@ def ensure_playwright_browser():
             browser.close()
     except Exception as e:
         if "Executable doesn't exist" in str(e) or "playwright install" in str(e):
-            logger.info("Playwright browser not found. Installing Chromium...")
-            result = subprocess.run(
-                [sys.executable, "-m", "playwright", "install", "chromium"],
-                capture_output=True, text=True
-            )
-            if result.returncode == 0:
-                logger.info("Playwright Chromium installed successfully.")
-            else:
-                logger.error(f"Failed to install Playwright Chromium: {result.stderr}")
+            return False
+    return True
+
+def ensure_playwright_browser():
+    """Install Playwright Chromium browser if not already present."""
+    if _chromium_installed():
+        return
+    logger.info("Playwright browser not found. Installing Chromium...")
+    result = subprocess.run(
+        [sys.executable, "-m", "playwright", "install", "chromium"],
+        capture_output=True, text=True
+    )
+    if result.returncode == 0:
+        logger.info("Playwright Chromium installed successfully.")
+    else:
+        logger.error(f"Failed to install Playwright Chromium: {result.stderr}")
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
@@ -52,26 +91,139 @@ DEFAULT_SETTINGS = {
 
 def load_settings() -> dict:
     if os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE) as f:
-            return {**DEFAULT_SETTINGS, **json.load(f)}
+        with open(SETTINGS_FILE, "rb") as f:
+            return {**DEFAULT_SETTINGS, **json_loads(f.read())}
     return DEFAULT_SETTINGS.copy()
 
-def save_settings(s: dict):
-    with open(SETTINGS_FILE, "w") as f:
-        json.dump(s, f, indent=2, ensure_ascii=False)
+settings_lock = asyncio.Lock()
+
+async def save_settings(s: dict):
+    """Write settings to a temp file and swap it in, so a crash never leaves a torn file."""
+    tmp = SETTINGS_FILE + ".tmp"
+    async with settings_lock:
+        async with aiofiles.open(tmp, "wb") as f:
+            await f.write(json_dumps(s))
+        os.replace(tmp, SETTINGS_FILE)
+
+# Handlers call schedule_save(); each call pushes the write back by SAVE_DELAY,
+# so a burst of /set_* commands collapses into one write.
+SAVE_DELAY = 0.5
+_save_dirty = False
+_save_handle: Optional[asyncio.TimerHandle] = None
+_save_task: Optional[asyncio.Task] = None
+
+def schedule_save():
+    global _save_dirty, _save_handle
+    _save_dirty = True
+    if _save_handle is not None:
+        _save_handle.cancel()
+    _save_handle = asyncio.get_running_loop().call_later(SAVE_DELAY, _flush_settings)
+
+def _flush_settings():
+    global _save_dirty, _save_handle, _save_task
+    _save_dirty = False
+    _save_handle = None
+    _save_task = asyncio.create_task(save_settings(settings))
+
+DB_FILE = "leadgen.db"
+
+def open_db() -> sqlite3.Connection:
+    # WAL + synchronous=NORMAL: commits don't fsync, so the small writes below
+    # are cheap enough to run directly on the event loop.
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS analysis_cache (key TEXT PRIMARY KEY, stored_at REAL, result BLOB)")
+    conn.execute("CREATE INDEX IF NOT EXISTS analysis_cache_stored_at ON analysis_cache (stored_at)")
+    conn.execute("CREATE TABLE IF NOT EXISTS seen_posts (url TEXT, snippet TEXT, seen_at REAL, PRIMARY KEY (url, snippet))")
+    conn.execute("CREATE INDEX IF NOT EXISTS seen_posts_seen_at ON seen_posts (seen_at)")
+    conn.commit()
+    return conn
+
+db = open_db()
+
+# Posts are keyed by (url, first 50 chars of text)
+SEEN_MAX = 50_000
+SEEN_TTL = 7 * 24 * 3600
+
+def load_seen_posts() -> OrderedDict:
+    """Load the newest post key -> last-seen timestamp pairs, dropping expired entries."""
+    rows = db.execute(
+        "SELECT url, snippet, seen_at FROM seen_posts WHERE seen_at >= ? ORDER BY seen_at DESC LIMIT ?",
+        (time.time() - SEEN_TTL, SEEN_MAX),
+    ).fetchall()
+    return OrderedDict(((sys.intern(url), snippet), seen_at) for url, snippet, seen_at in reversed(rows))
+
+# Keys marked since the last save_seen_posts() -> timestamp
+_seen_pending: dict = {}
+
+def save_seen_posts():
+    """Write keys marked this cycle and trim the table to the in-memory window."""
+    with db:
+        db.executemany("INSERT OR REPLACE INTO seen_posts VALUES (?, ?, ?)", ((*k, t) for k, t in _seen_pending.items()))
+        db.execute("DELETE FROM seen_posts WHERE seen_at < ?", (time.time() - SEEN_TTL,))
+        if seen_posts:
+            db.execute("DELETE FROM seen_posts WHERE seen_at < ?", (next(iter(seen_posts.values())),))
+    _seen_pending.clear()
+
+def prune_seen():
+    """Drop entries past SEEN_TTL; the oldest are always at the front."""
+    cutoff = time.time() - SEEN_TTL
+    while seen_posts and next(iter(seen_posts.values())) < cutoff:
+        seen_posts.popitem(last=False)
+
+def post_key(post: dict) -> tuple:
+    return sys.intern(post.get("url", "")), (post.get("text") or "")[:50]
+
+def mark_seen(key: tuple):
+    now = time.time()
+    seen_posts[key] = now
+    seen_posts.move_to_end(key)
+    _seen_pending[key] = now
+    while len(seen_posts) > SEEN_MAX:
+        seen_posts.popitem(last=False)
+
+def forget_seen(posts: list):
+    """Unmark posts whose screen or analysis didn't finish, so the next cycle retries them."""
+    for post in posts:
+        key = post_key(post)
+        seen_posts.pop(key, None)
+        _seen_pending.pop(key, None)
 
 settings = load_settings()
-seen_posts = set()
+seen_posts = load_seen_posts()
 monitoring_task: Optional[asyncio.Task] = None
 
 # ── Threads Scraper ───────────────────────────────────────────────────────────
-async def scrape_threads(keyword: str) -> list:
-    posts = []
-    url = f"https://www.threads.net/search?q={keyword.replace(' ', '+')}&serp_type=default"
-    
-    try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
+scrape_sem = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_SCRAPES", "3")))
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# Plain HTTP client for search pages that come back server-rendered; shared so
+# keywords reuse the connection to threads.net.
+threads_http = httpx.AsyncClient(
+    http2=True,
+    headers={
+        "User-Agent": USER_AGENT,
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "en-US,en;q=0.9",
+    },
+    follow_redirects=True,
+    timeout=10.0,
+)
+
+# One Chromium for the whole process; each scrape gets its own context.
+_pw = None
+_browser = None
+_browser_lock = asyncio.Lock()
+
+async def _get_browser():
+    global _pw, _browser
+    async with _browser_lock:
+        if _browser is None or not _browser.is_connected():
+            if _pw is None:
+                _pw = await async_playwright().start()
+            _browser = await _pw.chromium.launch(
                 headless=True,
                 args=[
                     "--no-sandbox",
@@ -80,51 +232,242 @@ async def scrape_threads(keyword: str) -> list:
                     "--disable-gpu",
                 ]
             )
-            context = await browser.new_context(
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                viewport={"width": 1280, "height": 800},
-                locale="en-US",
-            )
+    return _browser
+
+async def close_browser():
+    global _pw, _browser
+    async with _browser_lock:
+        if _browser is not None:
+            await _browser.close()
+            _browser = None
+        if _pw is not None:
+            await _pw.stop()
+            _pw = None
+
+async def _fetch_threads_html(url: str) -> Optional[str]:
+    """Fetch the search page without a browser; None if it has no embedded posts."""
+    try:
+        r = await threads_http.get(url)
+    except httpx.HTTPError as e:
+        logger.debug(f"HTTP fetch failed for {url}: {e}")
+        return None
+    if r.status_code != 200 or '"caption":{"text":"' not in r.text:
+        return None
+    return r.text
+
+async def scrape_threads(keyword: str) -> list:
+    posts = []
+    url = f"https://www.threads.net/search?q={keyword.replace(' ', '+')}&serp_type=default"
+    
+    # Any failure here falls through to the browser; one keyword must not abort the cycle
+    try:
+        html = await _fetch_threads_html(url)
+        if html is not None:
+            posts = parse_threads_html(html, keyword)
+    except Exception as e:
+        logger.warning(f"HTTP fetch error for '{keyword}': {e}")
+    if posts:
+        logger.info(f"Fetched {len(posts)} posts for '{keyword}' over HTTP")
+        return posts
+
+    try:
+        browser = await _get_browser()
+        context = await browser.new_context(
+            user_agent=USER_AGENT,
+            viewport={"width": 1280, "height": 800},
+            locale="en-US",
+        )
+        try:
             page = await context.new_page()
             
             await page.goto(url, wait_until="domcontentloaded", timeout=30000)
-            await asyncio.sleep(random.uniform(3, 5))
+            try:
+                await page.wait_for_selector('[role="main"]', timeout=8000)
+            except PlaywrightTimeoutError:
+                pass
             
-            # Scroll to load more posts
+            # Scroll to load more posts; stop waiting once the feed requests settle
             for _ in range(3):
                 await page.keyboard.press("End")
-                await asyncio.sleep(1.5)
+                try:
+                    await page.wait_for_load_state("networkidle", timeout=2000)
+                except PlaywrightTimeoutError:
+                    pass
             
             # Extract posts from page
             content = await page.content()
-            await browser.close()
-            
-            # Parse post data from HTML
-            posts = parse_threads_html(content, keyword)
-            logger.info(f"Scraped {len(posts)} posts for '{keyword}'")
+        finally:
+            await context.close()
+        
+        # Parse post data from HTML
+        posts = parse_threads_html(content, keyword)
+        logger.info(f"Scraped {len(posts)} posts for '{keyword}'")
             
     except Exception as e:
         logger.error(f"Scraper error for '{keyword}': {e}")
     
     return posts
 
+async def scrape_threads_bounded(keyword: str) -> list:
+    async with scrape_sem:
+        return await scrape_threads(keyword)
+
+_CAPTION_ANCHOR = '"caption":{"text":"'
+_USER_ANCHOR = '"user":{"pk":"'
+_USERNAME_ANCHOR = '"username":"'
+# How far past a caption its author's user object may start
+_USER_WINDOW = 2048
+
+def _string_end(html: str, start: int) -> int:
+    """Index of the quote closing the JSON string that starts at start, or -1."""
+    end = html.find('"', start)
+    while end != -1:
+        backslashes = 0
+        while html[end - 1 - backslashes] == "\\":
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return end
+        end = html.find('"', end + 1)
+    return -1
+
+def _iter_caption_users(html: str):
+    """Yield (raw caption text, user pk, username) by scanning for literal JSON keys."""
+    i = html.find(_CAPTION_ANCHOR)
+    while i != -1:
+        start = i + len(_CAPTION_ANCHOR)
+        end = _string_end(html, start)
+        if end == -1:
+            return
+        window = end + _USER_WINDOW
+        u = html.find(_USER_ANCHOR, end, window)
+        if u != -1 and 20 <= end - start <= 500:
+            pk_start = u + len(_USER_ANCHOR)
+            pk_end = html.find('"', pk_start, window)
+            n = html.find(_USERNAME_ANCHOR, pk_end, window) if pk_end != -1 else -1
+            if n != -1 and html[pk_start:pk_end].isdigit():
+                name_start = n + len(_USERNAME_ANCHOR)
+                name_end = html.find('"', name_start, window)
+                if name_end > name_start:
+                    yield html[start:end], html[pk_start:pk_end], html[name_start:name_end]
+        i = html.find(_CAPTION_ANCHOR, end)
+
+# Compiled once; DOTALL so .*? can cross line breaks inside embedded JSON
+_USERNAME_FULLNAME_TEXT_RE = re.compile(
+    r'"username":"([^"]+)"[^}]*"full_name":"([^"]*)".*?"text":"([^"]{20,500})"',
+    re.DOTALL,
+)
+# JSON string escapes; surrogate pairs first so emoji decode to one character
+_JSON_ESC_RE = re.compile(
+    r'\\u([dD][89abAB][0-9a-fA-F]{2})\\u([dD][c-fC-F][0-9a-fA-F]{2})|\\u([0-9a-fA-F]{4})|\\(.)',
+    re.DOTALL,
+)
+_SIMPLE_ESC = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+def _json_unescape_match(m: re.Match) -> str:
+    hi, lo, code, ch = m.groups()
+    if hi:
+        return chr(0x10000 + ((int(hi, 16) - 0xD800) << 10) + int(lo, 16) - 0xDC00)
+    if code:
+        return chr(int(code, 16))
+    return _SIMPLE_ESC.get(ch, ch)
+
+def json_unescape(text: str) -> str:
+    """Decode JSON string escapes in text cut out of raw page source."""
+    return _JSON_ESC_RE.sub(_json_unescape_match, text) if "\\" in text else text
+
+MAX_POSTS_PER_PAGE = 20
+_JSON_SCRIPT_OPEN = '<script type="application/json"'
+
+def _iter_json_scripts(html: str):
+    """Yield the parsed payload of every <script type="application/json"> block."""
+    i = html.find(_JSON_SCRIPT_OPEN)
+    while i != -1:
+        start = html.find(">", i) + 1
+        end = html.find("</script>", start)
+        if start == 0 or end == -1:
+            return
+        try:
+            yield json_loads(html[start:end])
+        except ValueError:
+            pass
+        i = html.find(_JSON_SCRIPT_OPEN, end)
+
+def _posts_from_json(data, keyword: str, seen: set, posts: list):
+    """Walk a Relay payload and collect every object that has caption.text and user.username."""
+    stack = [data]
+    while stack and len(posts) < MAX_POSTS_PER_PAGE:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+            continue
+        if not isinstance(node, dict):
+            continue
+
+        caption, user = node.get("caption"), node.get("user")
+        if isinstance(caption, dict) and isinstance(user, dict):
+            text, username = caption.get("text"), user.get("username")
+            if isinstance(text, str) and len(text) >= 20 and username:
+                key = (user.get("pk") or username, text)
+                if key not in seen:
+                    seen.add(key)
+                    code = node.get("code")
+                    posts.append({
+                        "text": text,
+                        "author": username,
+                        "author_id": user.get("pk"),
+                        "bio": user.get("biography") or "",
+                        "url": f"https://www.threads.net/@{username}/post/{code}" if code else f"https://www.threads.net/@{username}",
+                        "keyword": keyword,
+                    })
+        stack.extend(reversed(list(node.values())))
+
 def parse_threads_html(html: str, keyword: str) -> list:
+    """Extract posts from the JSON the page embeds; fall back to the rendered DOM, then regexes."""
+    posts = []
+    seen = set()
+    for data in _iter_json_scripts(html):
+        _posts_from_json(data, keyword, seen, posts)
+        if len(posts) >= MAX_POSTS_PER_PAGE:
+            break
+    if not posts and HTMLParser is not None:
+        posts = _parse_threads_dom(html, keyword)
+    return posts or _parse_threads_regex(html, keyword)
+
+def _parse_threads_dom(html: str, keyword: str) -> list:
+    """Read posts from rendered markup: each post is a pressable container with an
+    /@user profile link, an optional /post/ permalink and dir="auto" text blocks."""
+    posts = []
+    seen_texts = set()
+    for node in HTMLParser(html).css("[data-pressable-container]"):
+        profile = node.css_first('a[href^="/@"]')
+        if profile is None:
+            continue
+        username = profile.attributes.get("href", "")[2:].split("/", 1)[0]
+        text = max((t.text().strip() for t in node.css('[dir="auto"]')), key=len, default="")
+        if not username or len(text) < 20 or text in seen_texts:
+            continue
+        seen_texts.add(text)
+        permalink = node.css_first('a[href*="/post/"]')
+        path = permalink.attributes.get("href") if permalink is not None else f"/@{username}"
+        posts.append({
+            "text": text[:500],
+            "author": username,
+            "url": f"https://www.threads.net{path}",
+            "keyword": keyword,
+        })
+        if len(posts) >= MAX_POSTS_PER_PAGE:
+            break
+    return posts
+
+def _parse_threads_regex(html: str, keyword: str) -> list:
     posts = []
     
-    # Extract JSON data embedded in page
-    json_matches = re.findall(r'"text_post_app_thread":\{[^}]+\}', html)
-    
-    # Fallback: extract text blocks that look like posts
-    # Look for aria-label patterns and text content
-    text_pattern = re.findall(
-        r'"caption":\{"text":"([^"]{20,500})"[^}]*\}.*?"user":\{"pk":"(\d+)".*?"username":"([^"]+)"',
-        html
-    )
-    
+    # Fallback: caption objects followed closely by their author's user object
     seen_texts = set()
-    for match in text_pattern[:20]:
-        text, user_id, username = match
-        text = text.encode().decode('unicode_escape', errors='ignore')
+    for text, user_id, username in _iter_caption_users(html):
+        if len(posts) >= MAX_POSTS_PER_PAGE:
+            break
+        text = json_unescape(text)
         
         if text in seen_texts:
             continue
@@ -140,16 +483,10 @@ def parse_threads_html(html: str, keyword: str) -> list:
     
     # If regex didn't work, try another pattern
     if not posts:
-        alt_pattern = re.findall(
-            r'"username":"([^"]+)"[^}]*"full_name":"([^"]*)".*?"text":"([^"]{20,500})"',
-            html
-        )
-        for match in alt_pattern[:20]:
+        alt_pattern = _USERNAME_FULLNAME_TEXT_RE.findall(html)
+        for match in alt_pattern[:MAX_POSTS_PER_PAGE]:
             username, full_name, text = match
-            try:
-                text = text.encode().decode('unicode_escape', errors='ignore')
-            except Exception:
-                pass
+            text = json_unescape(text)
             
             if text in seen_texts:
                 continue
@@ -166,87 +503,353 @@ def parse_threads_html(html: str, keyword: str) -> list:
     return posts
 
 # ── AI Analysis ──────────────────────────────────────────────────────────────
-def analyze_post(text: str, author: str, author_bio: str) -> dict:
-    client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-    prompt = f"""You are a B2B sales intelligence analyst. Analyze this Threads post.
+# One keep-alive pool for all Claude calls; HTTP/2 lets concurrent analyses
+# share connections instead of paying a TLS handshake each.
+anthropic_client = anthropic.AsyncAnthropic(
+    api_key=ANTHROPIC_API_KEY,
+    max_retries=2,
+    http_client=httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    ),
+)
+
+# Cheap model screens every post; the expensive one only sees posts that pass.
+# The screen lets through posts up to SCREEN_MARGIN below min_score so
+# borderline leads get a second opinion instead of a hard Haiku cut-off.
+SCORING_MODEL = "claude-haiku-4-5"
+ANALYSIS_MODEL = "claude-opus-4-6"
+SCREEN_MARGIN = 1
+
+# Static parts of the prompts; sent with the seller settings as the system
+# block, so the user turn carries only the post itself. Results come back
+# as forced tool calls, so the reply is always a parsed object. Keys are single
+# letters to keep output tokens down and are expanded by _expand_analysis.
+SCORING_INSTRUCTIONS = """You are a B2B sales intelligence analyst. Rate every numbered Threads post from the user message as a lead for the seller and record all of them in one emit_scores call."""
 
-POST: {text[:1500]}
+ANALYSIS_INSTRUCTIONS = """You are a B2B sales intelligence analyst. Analyze the Threads post from the user message as a lead for the seller and record it with the emit_lead tool."""
+
+_SCORE_PROPS = {
+    "s": {"type": "integer", "minimum": 0, "maximum": 10, "description": "relevance 0-10"},
+    "i": {"type": "string", "enum": ["low", "medium", "high"], "description": "buying intent"},
+}
+
+SCORING_TOOL = {
+    "name": "emit_scores",
+    "description": "Record the lead relevance screen for each post.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "r": {
+                "type": "array",
+                "description": "one entry per post",
+                "items": {
+                    "type": "object",
+                    "properties": {"n": {"type": "integer", "description": "post number"}, **_SCORE_PROPS},
+                    "required": ["n", "s", "i"],
+                },
+            },
+        },
+        "required": ["r"],
+    },
+}
+
+# "s" comes first so the streaming early abort sees it before the long fields
+ANALYSIS_TOOL = {
+    "name": "emit_lead",
+    "description": "Record the full lead analysis.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "s": _SCORE_PROPS["s"],
+            "p": {"type": "array", "items": {"type": "string"}, "description": "pain points"},
+            "r": {"type": "string", "description": "likely role"},
+            "c": {"type": "string", "enum": ["startup", "smb", "enterprise", "individual"], "description": "company stage"},
+            "i": _SCORE_PROPS["i"],
+            "t": {"type": "string", "description": "personality, one sentence"},
+            "w": {"type": "string", "description": "why good lead, 2-3 sentences"},
+            "m": {"type": "string", "description": "personalized DM, 3-4 sentences, warm not salesy, in LANGUAGE"},
+        },
+        "required": ["s", "p", "r", "c", "i", "t", "w", "m"],
+    },
+}
+
+def _tool_input(msg) -> Optional[dict]:
+    for block in msg.content:
+        if block.type == "tool_use":
+            return block.input
+    return None
+
+def _expand_analysis(d: dict) -> dict:
+    return {
+        "relevance_score": d.get("s", 0),
+        "pain_points": d.get("p", []),
+        "author_insights": {
+            "likely_role": d.get("r", "?"),
+            "company_stage": d.get("c", "?"),
+            "buying_intent": d.get("i", "?"),
+            "personality": d.get("t", "?"),
+        },
+        "opportunity_summary": d.get("w", "?"),
+        "outreach_message": d.get("m", "?"),
+    }
+
+def _system_prompt(instructions: str) -> list:
+    """System block: static instructions plus the seller settings.
+
+    Not marked for prompt caching: with the tool schema it is a few hundred
+    tokens, well under the models' minimum cacheable prefix.
+    """
+    text = f"""{instructions}
+
+WE SELL: {settings.get('your_product') or 'not specified'}
+SELLER: {settings.get('your_name') or 'not specified'}
+LANGUAGE: {settings.get('language', 'uk')}"""
+    return [{"type": "text", "text": text}]
+
+def _post_fields(post: dict) -> tuple:
+    return post.get("text") or "", post.get("author") or "unknown", post.get("bio") or ""
+
+def _post_prompt(text: str, author: str, author_bio: str) -> str:
+    return f"""POST: {text[:800]}
 AUTHOR: @{author}
-BIO: {author_bio or 'no bio'}
-WE SELL: {settings.get('your_product', 'not specified')}
-SELLER: {settings.get('your_name', 'not specified')}
-
-Respond ONLY with valid JSON:
-{{
-  "relevance_score": <0-10>,
-  "pain_points": ["pain1", "pain2"],
-  "author_insights": {{
-    "likely_role": "role",
-    "company_stage": "startup/smb/enterprise/individual",
-    "buying_intent": "low/medium/high",
-    "personality": "one sentence"
-  }},
-  "opportunity_summary": "2-3 sentences why good lead",
-  "outreach_message": "personalized DM 3-4 sentences warm not salesy in {settings.get('language', 'uk')}"
-}}"""
-
-    msg = client.messages.create(
-        model="claude-opus-4-6",
-        max_tokens=1000,
-        messages=[{"role": "user", "content": prompt}]
-    )
+BIO: {author_bio or 'no bio'}"""
+
+# Matches the score only once the number is complete (followed by , } or newline).
+_SCORE_RE = re.compile(r'"s"\s*:\s*(\d+)\s*[,}\n]')
+
+# Exact-match response cache: hash of the prompt inputs -> (timestamp, result).
+# Kept in memory for lookups and written through to SQLite so it survives restarts.
+ANALYSIS_CACHE_MAX = 4096
+ANALYSIS_CACHE_TTL = 24 * 3600
+
+def load_analysis_cache() -> OrderedDict:
+    rows = db.execute(
+        "SELECT key, stored_at, result FROM analysis_cache WHERE stored_at >= ? ORDER BY stored_at DESC LIMIT ?",
+        (time.time() - ANALYSIS_CACHE_TTL, ANALYSIS_CACHE_MAX),
+    ).fetchall()
+    return OrderedDict((key, (stored_at, json_loads(result))) for key, stored_at, result in reversed(rows))
+
+analysis_cache: OrderedDict = load_analysis_cache()
+
+def _cache_key(stage: str, text: str, author: str, author_bio: str) -> str:
+    parts = (stage, text, author, author_bio or "",
+             settings.get("your_product") or "", settings.get("your_name") or "", settings.get("language") or "")
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+def _cache_get(key: str) -> Optional[dict]:
+    entry = analysis_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, result = entry
+    if time.time() - stored_at > ANALYSIS_CACHE_TTL:
+        del analysis_cache[key]
+        return None
+    analysis_cache.move_to_end(key)
+    return result
+
+def _cache_put(key: str, result: dict):
+    now = time.time()
+    analysis_cache[key] = (now, result)
+    analysis_cache.move_to_end(key)
+    while len(analysis_cache) > ANALYSIS_CACHE_MAX:
+        analysis_cache.popitem(last=False)
+    with db:
+        db.execute("INSERT OR REPLACE INTO analysis_cache VALUES (?, ?, ?)", (key, now, json_dumps(result, indent=False)))
+        db.execute("DELETE FROM analysis_cache WHERE stored_at < ?", (now - ANALYSIS_CACHE_TTL,))
+
+# Requests currently in flight, so concurrent callers for the same post share
+# one Claude call instead of each paying for it.
+_inflight: dict = {}
+# key -> number of callers awaiting the shared request
+_waiters: dict = {}
+
+def _request_done(key: str, task: asyncio.Task):
+    _inflight.pop(key, None)
+    waiters = _waiters.pop(key, 0)
+    # Waiters re-raise the error themselves; otherwise log it here so it isn't lost
+    if not task.cancelled() and task.exception() is not None and not waiters:
+        logger.error(f"Claude request error: {task.exception()!r}")
+
+async def _coalesced(key: str, factory):
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(factory())
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _request_done(key, t))
+    _waiters[key] = _waiters.get(key, 0) + 1
     try:
-        return json.loads(msg.content[0].text)
-    except Exception:
-        return {
-            "relevance_score": 5,
-            "pain_points": [],
-            "author_insights": {"likely_role": "?", "company_stage": "?", "buying_intent": "medium", "personality": "?"},
-            "opportunity_summary": msg.content[0].text[:300],
-            "outreach_message": "Привіт! Бачив твій пост і подумав що можу допомогти."
-        }
+        # shield: one caller being cancelled must not cancel the shared request
+        return await asyncio.shield(task)
+    finally:
+        if not task.done():
+            _waiters[key] -= 1
+            if _waiters[key] == 0:
+                # Last caller gave up (timeout or stop): don't keep paying for the stream
+                task.cancel()
+
+SCREEN_BATCH_SIZE = 10
+
+async def score_posts(posts: list) -> list:
+    """Quick relevance screen on the cheap model, one call for the whole batch.
+
+    Returns one {"relevance_score", "buying_intent"} dict per post, in order.
+    """
+    keys = [_cache_key("score", *_post_fields(p)) for p in posts]
+    screens = [_cache_get(k) for k in keys]
+    pending = [i for i, screen in enumerate(screens) if screen is None]
+    if not pending:
+        return screens
+
+    content = "\n\n".join(f"## POST {n}\n{_post_prompt(*_post_fields(posts[i]))}" for n, i in enumerate(pending, 1))
+    msg = await anthropic_client.messages.create(
+        model=SCORING_MODEL,
+        max_tokens=50 + 40 * len(pending),
+        system=_system_prompt(SCORING_INSTRUCTIONS),
+        tools=[SCORING_TOOL],
+        tool_choice={"type": "tool", "name": SCORING_TOOL["name"]},
+        messages=[{"role": "user", "content": content}]
+    )
+    d = _tool_input(msg) or {}
+    by_n = {e.get("n"): e for e in d.get("r", []) if isinstance(e, dict)}
+
+    for n, i in enumerate(pending, 1):
+        e = by_n.get(n)
+        if e is None or "s" not in e:
+            screens[i] = {"relevance_score": 5, "buying_intent": "medium"}
+            continue
+        screens[i] = {"relevance_score": e["s"], "buying_intent": e.get("i", "?")}
+        _cache_put(keys[i], screens[i])
+    return screens
+
+async def deep_analyze(text: str, author: str, author_bio: str, min_score: Optional[int] = None) -> Optional[dict]:
+    """Full lead analysis on the expensive model.
+
+    When min_score is given, the response is streamed and generation is
+    abandoned as soon as the model emits a relevance_score below it.
+    Completed analyses are cached per post and seller settings. Returns None
+    when the reply carries no score at all.
+    """
+    key = _cache_key("analysis", text, author, author_bio)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    return await _coalesced(f"{key}:{min_score}", lambda: _request_analysis(text, author, author_bio, min_score, key))
+
+ANALYSIS_MAX_TOKENS = 600
+# One retry for replies cut off at ANALYSIS_MAX_TOKENS; long Ukrainian DMs need it
+ANALYSIS_RETRY_MAX_TOKENS = 1500
+
+async def _stream_lead(text: str, author: str, author_bio: str, min_score: Optional[int], max_tokens: int) -> tuple:
+    """Stream one emit_lead call and return (tool input, stop reason).
+
+    The stop reason is "min_score" when generation was abandoned on a score
+    below min_score; the tool input then holds only "s".
+    """
+    buf = ""
+    async with anthropic_client.messages.stream(
+        model=ANALYSIS_MODEL,
+        max_tokens=max_tokens,
+        system=_system_prompt(ANALYSIS_INSTRUCTIONS),
+        tools=[ANALYSIS_TOOL],
+        tool_choice={"type": "tool", "name": ANALYSIS_TOOL["name"]},
+        messages=[{"role": "user", "content": _post_prompt(text, author, author_bio)}]
+    ) as stream:
+        async for event in stream:
+            if min_score is None or event.type != "input_json":
+                continue
+            buf += event.partial_json
+            m = _SCORE_RE.search(buf)
+            if m:
+                score = int(m.group(1))
+                if score < min_score:
+                    return {"s": score}, "min_score"
+                min_score = None
+        final = await stream.get_final_message()
+    return _tool_input(final), final.stop_reason
+
+async def _request_analysis(text: str, author: str, author_bio: str, min_score: Optional[int], key: str) -> Optional[dict]:
+    d, stop_reason = await _stream_lead(text, author, author_bio, min_score, ANALYSIS_MAX_TOKENS)
+    if stop_reason == "min_score":
+        return {"relevance_score": d["s"], "pain_points": [], "author_insights": {}}
+    if stop_reason == "max_tokens":
+        # The score already cleared min_score, so the longer run is worth paying for
+        retry, stop_reason = await _stream_lead(text, author, author_bio, None, ANALYSIS_RETRY_MAX_TOKENS)
+        if retry and "s" in retry:
+            d = retry
+
+    if not d or "s" not in d:
+        return None
+    analysis = _expand_analysis(d)
+
+    # A reply cut off at max_tokens still parses; send what it has but don't cache it
+    if stop_reason != "max_tokens" and all(k in d for k in ANALYSIS_TOOL["input_schema"]["required"]):
+        _cache_put(key, analysis)
+    return analysis
 
 # ── Format ────────────────────────────────────────────────────────────────────
+_MD_STRIP = str.maketrans('', '', '_*[]`~')
+
 def clean(s: str) -> str:
-    for ch in ['_', '*', '[', ']', '`', '~']:
-        s = str(s).replace(ch, '')
-    return s
+    return str(s).translate(_MD_STRIP)
 
-def format_lead(post: dict, analysis: dict) -> str:
-    score = analysis.get("relevance_score", 0)
-    score_emoji = "🔥" if score >= 8 else "⚡" if score >= 6 else "📌"
-    intent_emoji = {"high": "🎯", "medium": "👀", "low": "💤"}.get(
-        analysis.get("author_insights", {}).get("buying_intent", "low"), "💤"
-    )
-    ai = analysis.get("author_insights", {})
-    pain_points = "\n".join(f"  • {clean(p)}" for p in analysis.get("pain_points", []))
-    author = clean(post.get("author") or "unknown")
-    text = clean(post.get("text") or "")
-    post_url = post.get("url") or f"https://www.threads.net/@{author}"
+INTENT_EMOJI = {"high": "🎯", "medium": "👀", "low": "💤"}
+TELEGRAM_MAX_LEN = 4096
 
-    return f"""{score_emoji} Новий лід з Threads! [{score}/10]
+LEAD_TEMPLATE = """{score_emoji} Новий лід з Threads! [{score}/10]
 
 👤 @{author} {intent_emoji}
 {post_url}
 
-📝 {text[:300]}
+📝 {text}
 
 ━━━━━━━━━━━━━━
 🧠 Інсайти:
-  • Роль: {clean(ai.get('likely_role', '?'))}
-  • Компанія: {clean(ai.get('company_stage', '?'))}
-  • Інтент: {clean(ai.get('buying_intent', '?'))}
-  • {clean(ai.get('personality', ''))}
+  • Роль: {role}
+  • Компанія: {company_stage}
+  • Інтент: {buying_intent}
+  • {personality}
 
 💥 Болі:
-{clean(pain_points)}
+{pain_points}
 
 💡 Чому лід:
-{clean(analysis.get('opportunity_summary', ''))}
+{summary}
 
 ━━━━━━━━━━━━━━
 ✉️ Готове повідомлення:
-{clean(analysis.get('outreach_message', ''))}"""
+{outreach}"""
+
+class _Defaulting(dict):
+    """format_map mapping that renders any missing field as '?'."""
+    def __missing__(self, key):
+        return "?"
+
+def format_lead(post: dict, analysis: dict) -> str:
+    score = analysis.get("relevance_score", 0)
+    ai = analysis.get("author_insights") or {}
+    author = clean(post.get("author") or "unknown")
+
+    msg = LEAD_TEMPLATE.format_map(_Defaulting(
+        score=score,
+        score_emoji="🔥" if score >= 8 else "⚡" if score >= 6 else "📌",
+        intent_emoji=INTENT_EMOJI.get(ai.get("buying_intent", "low"), "💤"),
+        author=author,
+        post_url=post.get("url") or f"https://www.threads.net/@{author}",
+        text=clean(post.get("text") or "")[:300],
+        role=clean(ai.get("likely_role", "?")),
+        company_stage=clean(ai.get("company_stage", "?")),
+        buying_intent=clean(ai.get("buying_intent", "?")),
+        personality=clean(ai.get("personality", "")),
+        pain_points="\n".join(f"  • {clean(p)}" for p in analysis.get("pain_points", [])),
+        summary=clean(analysis.get("opportunity_summary", "")),
+        outreach=clean(analysis.get("outreach_message", "")),
+    ))
+    # Long model output must not make Telegram reject the whole lead
+    if len(msg) > TELEGRAM_MAX_LEN:
+        msg = msg[:TELEGRAM_MAX_LEN - 1] + "…"
+    return msg
 
 # ── Handlers ──────────────────────────────────────────────────────────────────
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -270,39 +873,40 @@ async def setup(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /set_language uk""")
 
 async def set_keywords(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global settings
+    global settings, _kw_regex_key
     if not context.args:
         await update.message.reply_text("Використання: /set_keywords слово1 слово2")
         return
     # Deduplicate keywords
     keywords = list(dict.fromkeys(context.args))
     settings["keywords"] = keywords
-    save_settings(settings)
+    _kw_regex_key = None
+    schedule_save()
     await update.message.reply_text(f"Ключові слова: {', '.join(keywords)}")
 
 async def set_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global settings
     settings["your_product"] = " ".join(context.args)
-    save_settings(settings)
+    schedule_save()
     await update.message.reply_text(f"Продукт: {settings['your_product']}")
 
 async def set_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global settings
     settings["your_name"] = " ".join(context.args)
-    save_settings(settings)
+    schedule_save()
     await update.message.reply_text(f"Ім'я: {settings['your_name']}")
 
 async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global settings
     settings["language"] = context.args[0] if context.args else "uk"
-    save_settings(settings)
+    schedule_save()
     await update.message.reply_text(f"Мова: {settings['language']}")
 
 async def set_score(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global settings
     try:
         settings["min_score"] = max(0, min(10, int(context.args[0])))
-        save_settings(settings)
+        schedule_save()
         await update.message.reply_text(f"Мінімальний скор: {settings['min_score']}")
     except (IndexError, ValueError):
         await update.message.reply_text("Використання: /set_score 5")
@@ -322,7 +926,7 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def toggle_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global settings
     settings["mode"] = "auto_send" if settings["mode"] == "notify" else "notify"
-    save_settings(settings)
+    schedule_save()
     await update.message.reply_text(f"Режим: {'Авто' if settings['mode'] == 'auto_send' else 'Notify'}")
 
 async def test_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -332,8 +936,10 @@ async def test_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "text": "Шукаю веб дизайнера для редизайну сайту. Є бюджет, потрібен хтось хто розуміє B2B і може зробити лендінг що конвертує.",
         "url": "https://www.threads.net/@startup_ceo_ua"
     }
-    loop = asyncio.get_event_loop()
-    analysis = await loop.run_in_executor(None, analyze_post, fake_post["text"], fake_post["author"], "CEO at B2B startup")
+    analysis = await deep_analyze(fake_post["text"], fake_post["author"], "CEO at B2B startup")
+    if analysis is None:
+        await update.message.reply_text("❌ Claude не повернув аналіз, спробуй ще раз.")
+        return
     msg = format_lead(fake_post, analysis)
     keyboard = [[InlineKeyboardButton("Профіль", url=fake_post["url"])]]
     await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), disable_web_page_preview=True)
@@ -353,6 +959,10 @@ async def stop_monitor(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global monitoring_task
     if monitoring_task and not monitoring_task.done():
         monitoring_task.cancel()
+        # Let the cycle unwind (and close its browser context) before the browser goes
+        with contextlib.suppress(asyncio.CancelledError):
+            await monitoring_task
+        await close_browser()
         await update.message.reply_text("🔴 Зупинено.")
     else:
         await update.message.reply_text("Не запущено.")
@@ -360,53 +970,164 @@ async def stop_monitor(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
 
+# ── Keyword Filter ────────────────────────────────────────────────────────────
+_kw_regex: Optional[re.Pattern] = None
+_kw_regex_key: Optional[tuple] = None
+
+def kw_matches(text: str) -> bool:
+    """Return True if text contains a word starting with any configured keyword (case-insensitive).
+
+    Only the start is anchored so inflected forms (дизайн -> дизайнера) still match.
+    """
+    global _kw_regex, _kw_regex_key
+    key = tuple(settings["keywords"])
+    if key != _kw_regex_key:
+        _kw_regex = re.compile(r"(?<!\w)(?:" + "|".join(re.escape(k) for k in key) + ")", re.IGNORECASE) if key else None
+        _kw_regex_key = key
+    return bool(_kw_regex and _kw_regex.search(text))
+
+# Buying-intent cues; posts without any of them are not worth a Claude call.
+# Cyrillic cues are stems anchored only at the start so inflected forms
+# (потрібен, потрібна...) match; English cues are whole words.
+INTENT_RE = re.compile(
+    r"\b(?:шука|потріб|порад|порекоменд|підкаж|хто може|бюджет|замов|"
+    r"ищу|ищем|нужен|нужна|нужно|посовет)"
+    r"|\b(?:looking for|needs?|needed|recommend\w*|hiring|hire|budget|anyone know|who can)\b",
+    re.IGNORECASE,
+)
+
+# Optional local lead classifier: a pickled scikit-learn pipeline that takes raw
+# post texts (e.g. TfidfVectorizer + LogisticRegression). The probability column
+# is picked from its classes_ by LEAD_CLASSIFIER_LABEL, compared as a string
+# (1 for 0/1 labels, True, or e.g. lead). Without it every post that passes the
+# filters above goes to Claude.
+LEAD_CLASSIFIER_PATH = os.getenv("LEAD_CLASSIFIER_PATH")
+LEAD_CLASSIFIER_LABEL = os.getenv("LEAD_CLASSIFIER_LABEL", "1")
+LEAD_MIN_PROBA = float(os.getenv("LEAD_MIN_PROBA", "0.3"))
+
+def load_lead_classifier() -> tuple:
+    """Return (classifier, index of the lead class in predict_proba), or (None, None)."""
+    if not LEAD_CLASSIFIER_PATH:
+        return None, None
+    try:
+        with open(LEAD_CLASSIFIER_PATH, "rb") as f:
+            clf = pickle.load(f)
+        labels = [str(c) for c in clf.classes_]
+        column = labels.index(LEAD_CLASSIFIER_LABEL)
+    except Exception as e:
+        logger.warning(f"Lead classifier not loaded: {e}")
+        return None, None
+    logger.info(f"Lead classifier loaded from {LEAD_CLASSIFIER_PATH}")
+    return clf, column
+
+lead_classifier, _lead_column = load_lead_classifier()
+
+def likely_leads(posts: list) -> list:
+    """Drop posts the local classifier rates below LEAD_MIN_PROBA."""
+    if lead_classifier is None or not posts:
+        return posts
+    try:
+        proba = lead_classifier.predict_proba([p["text"] for p in posts])[:, _lead_column]
+    except Exception as e:
+        logger.warning(f"Lead classifier failed: {e}")
+        return posts
+    return [p for p, pr in zip(posts, proba) if pr >= LEAD_MIN_PROBA]
+
 # ── Monitor Loop ──────────────────────────────────────────────────────────────
+analysis_sem = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_ANALYSES", "8")))
+# Upper bound on one Claude step (batch screen or full analysis + send),
+# counted from when it gets a semaphore slot
+LEAD_TIMEOUT = 60
+
+async def _guarded(coro, what: str):
+    """Log a failed step so it does not cancel its siblings in the TaskGroup."""
+    try:
+        await coro
+    except Exception as e:
+        logger.error(f"{what} error: {e!r}")
+
+async def _screen_batch(app: Application, posts: list):
+    try:
+        async with analysis_sem, asyncio.timeout(LEAD_TIMEOUT):
+            screens = await score_posts(posts)
+    except BaseException:
+        # Failed, timed out or stopped: leave these posts for the next cycle
+        forget_seen(posts)
+        raise
+    async with asyncio.TaskGroup() as tg:
+        for post, screen in zip(posts, screens):
+            if screen["relevance_score"] >= settings["min_score"] - SCREEN_MARGIN:
+                tg.create_task(_guarded(_handle_post(app, post), "Lead handling"))
+
+async def _handle_post(app: Application, post: dict):
+    try:
+        await _analyze_and_send(app, post)
+    except BaseException:
+        forget_seen([post])
+        raise
+
+async def _analyze_and_send(app: Application, post: dict):
+    text, author, bio = _post_fields(post)
+
+    async with analysis_sem, asyncio.timeout(LEAD_TIMEOUT):
+        analysis = await deep_analyze(text, author, bio, min_score=settings["min_score"])
+
+        if analysis is None:
+            logger.warning(f"No usable analysis for @{author}, skipping")
+            return
+        if analysis["relevance_score"] < settings["min_score"]:
+            return
+
+        msg = format_lead(post, analysis)
+        post_url = post.get("url") or f"https://www.threads.net/@{author}"
+        keyboard = [[
+            InlineKeyboardButton("Пост", url=post_url),
+            InlineKeyboardButton("Профіль", url=f"https://www.threads.net/@{author}")
+        ]]
+
+        await app.bot.send_message(
+            chat_id=TELEGRAM_CHAT_ID,
+            text=msg,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            disable_web_page_preview=True
+        )
+
 async def monitor_loop(app: Application):
     logger.info(f"Monitor started: {settings['keywords']}")
     while True:
         try:
-            for keyword in settings["keywords"]:
-                posts = await scrape_threads(keyword)
+            prune_seen()
+            keywords = list(settings["keywords"])
+            results = await asyncio.gather(*(scrape_threads_bounded(k) for k in keywords))
+
+            candidates = []
+            for keyword, posts in zip(keywords, results):
                 logger.info(f"'{keyword}': {len(posts)} posts")
 
                 for post in posts:
-                    post_id = post.get("url", "") + (post.get("text") or "")[:50]
-                    if post_id in seen_posts:
+                    key = post_key(post)
+                    if key in seen_posts:
                         continue
-                    seen_posts.add(post_id)
+                    mark_seen(key)
 
                     text = post.get("text") or ""
                     if not text or len(text) < 20:
                         continue
-
-                    author = post.get("author") or "unknown"
-                    bio = post.get("bio") or ""
-
-                    loop = asyncio.get_event_loop()
-                    analysis = await loop.run_in_executor(None, analyze_post, text, author, bio)
-
-                    if analysis["relevance_score"] < settings["min_score"]:
+                    if not kw_matches(text) or not INTENT_RE.search(text):
                         continue
+                    candidates.append(post)
 
-                    msg = format_lead(post, analysis)
-                    post_url = post.get("url") or f"https://www.threads.net/@{author}"
-                    keyboard = [[
-                        InlineKeyboardButton("Пост", url=post_url),
-                        InlineKeyboardButton("Профіль", url=f"https://www.threads.net/@{author}")
-                    ]]
-
-                    await app.bot.send_message(
-                        chat_id=TELEGRAM_CHAT_ID,
-                        text=msg,
-                        reply_markup=InlineKeyboardMarkup(keyboard),
-                        disable_web_page_preview=True
-                    )
+            candidates = likely_leads(candidates)
 
-                    await asyncio.sleep(2)
+            # Wait for every lead of this cycle; stop_monitor cancels them all
+            async with asyncio.TaskGroup() as tg:
+                for i in range(0, len(candidates), SCREEN_BATCH_SIZE):
+                    tg.create_task(_guarded(_screen_batch(app, candidates[i:i + SCREEN_BATCH_SIZE]), "Screening"))
 
-                await asyncio.sleep(10)
+            save_seen_posts()
 
         except asyncio.CancelledError:
+            save_seen_posts()
             break
         except Exception as e:
             logger.error(f"Monitor error: {e}")
@@ -414,9 +1135,52 @@ async def monitor_loop(app: Application):
         await asyncio.sleep(1800)  # 30 хвилин
 
 # ── Main ──────────────────────────────────────────────────────────────────────
+async def _warm_up_anthropic():
+    """Open the Claude connection and build the SDK's request models before the first lead."""
+    try:
+        await anthropic_client.messages.create(
+            model=SCORING_MODEL,
+            max_tokens=1,
+            messages=[{"role": "user", "content": "."}]
+        )
+    except Exception as e:
+        logger.warning(f"Anthropic warm-up failed: {e}")
+
+async def on_startup(app: Application):
+    app.create_task(_warm_up_anthropic())
+
+async def on_shutdown(app: Application):
+    # Stop the monitor first so its last cycle saves seen posts while the handles are open
+    if monitoring_task and not monitoring_task.done():
+        monitoring_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await monitoring_task
+    if _save_handle is not None:
+        _save_handle.cancel()
+    if _save_task is not None:
+        await _save_task
+    if _save_dirty:
+        await save_settings(settings)
+    await close_browser()
+    await threads_http.aclose()
+    await anthropic_client.close()
+    db.close()
+
 def main():
     ensure_playwright_browser()
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    # AIORateLimiter keeps outgoing sends under Telegram's global and per-chat
+    # limits and retries on RetryAfter instead of failing the lead. HTTP/2 lets
+    # concurrent sends share one connection to api.telegram.org.
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .http_version("2")
+        .concurrent_updates(True)
+        .rate_limiter(AIORateLimiter(max_retries=3))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("setup", setup))
     app.add_handler(CommandHandler("status", status))